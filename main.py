@@ -3,17 +3,33 @@ import json
 import time
 import logging
 import cloudscraper
+import requests
 import html
 import re
 import random
+import hashlib
+import base64
+import codecs
+import sqlite3
+import shutil
+import asyncio
+import collections
+import heapq
 import concurrent.futures
-import feedparser
-from urllib.parse import quote, unquote
+import aiohttp
+from urllib.parse import quote, quote_plus, unquote, urlsplit, urlunsplit, parse_qsl, urlencode
+from urllib3.util.retry import Retry
+from email.utils import parsedate_to_datetime
 from datetime import datetime, timedelta, timezone
-from bs4 import BeautifulSoup
-from gnews import GNews
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.dammit import EncodingDetector
+from lxml import etree
 from ddgs import DDGS
-from dateutil import parser
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # --- CONFIGURATION ---
 CONFIG = {
@@ -24,7 +40,9 @@ CONFIG = {
     ],
     'FILES': {
         'NEWS': 'news.json',
-        'MARKET': 'market.json'
+        'MARKET': 'market.json',
+        'FEEDS': 'feeds.json',
+        'HISTORY': 'history.db'
     },
     'TELEGRAM': {
         'BOT_TOKEN': os.environ.get('TG_BOT_TOKEN'), 
@@ -32,9 +50,23 @@ CONFIG = {
     },
     'PROXY_URL': 'https://raw.githubusercontent.com/itsyebekhe/MTProtoNexus/refs/heads/gh-pages/extracted_proxies.json',
     'TIMEOUT': 20,
-    'MAX_WORKERS': 4,
+    'AI_CONCURRENCY': 16,
+    'FETCH_CONCURRENCY': 10,
+    'DDG_CONCURRENCY': 2,
+    'GNEWS_MAX_RESULTS': 5,
+    'MAX_PAGE_BYTES': 512 * 1024,
+    'MIN_PAGE_BYTES': 2000,
+    'FETCH_DEADLINE': 15,
     'POLLINATIONS_KEY': os.environ.get('POLLINATIONS_API_KEY'),
-    'AI_RETRIES': 3
+    'AI_RETRIES': 3,
+    'AI_TIMEOUT': 30,
+    'AI_BATCH_SIZE': 5,
+    'AI_BATCH_WAIT': 2.0,
+    'AI_CACHE_SIZE': 500,
+    'AI_RPM': 30,
+    'AI_BREAKER_THRESHOLD': 5,
+    'AI_BREAKER_RESET': 30,
+    'HISTORY_DAYS': 30
 }
 
 PROXY_NAMES = [
@@ -44,93 +76,406 @@ PROXY_NAMES = [
     "Tahmineh", "Gordafarid", "Cassandan", "Atusa", "Roxana", "Mandana"
 ]
 
+# --- TEXT MATCHING ---
+_WORD_RE = re.compile(r'\W+')
+# ASCII-only equivalent of _WORD_RE.sub('', ...): drop every non-word codepoint
+_NORM_TABLE = {c: None for c in range(128) if not (chr(c).isalnum() or chr(c) == '_')}
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_ARTICLE_CLASS_RE = re.compile(r'(article|story|body|content)')
+_BING_URL_RE = re.compile(r'[?&]url=([^&]+)')
+_TAG_RE = re.compile(r'<[^>]+>')
+# Byte-level probes over raw article pages: is there a container worth a DOM
+# parse at all, and if not, the <p> bodies for the paragraph fallback
+_CONTAINER_PROBE_RE = re.compile(rb'itemprop=["\']?articleBody|<div[^>]+class=["\'][^"\']*(?:article|story|body|content)', re.I)
+# A <p> body ends at </p>, the next <p> or a block tag (closing </p> is
+# optional in HTML); the tempered scan keeps unclosed <p> pages linear
+_PARAGRAPH_RE = re.compile(
+    rb'<p(?:\s[^>]*)?>((?:(?!</?(?:p|div|section|article|ul|ol|table|h[1-6])[\s>/]).)*)', re.I | re.S)
+_SCRIPT_STYLE_RE = re.compile(rb'<(script|style)\b.*?</\1\s*>', re.I | re.S)
+# State-media publishers, and TARGET_SOURCES domains searched with a Persian query
+_REGIME_RE = re.compile(r'tasnim|fars|irna|press|mehr')
+_PERSIAN_SITE_RE = re.compile(r'tasnim|fars|irna|bbc\.com/persian|radiofarda')
+# Cheap pre-AI urgency signal, used only to order work so likely-urgent items go first
+# English terms are whole words (plus inflections) so "forward" or "software"
+# don't count; Persian stems stay unanchored to match their attached affixes
+_URGENT_RE = re.compile(
+    r'\b(?:breaking|attack(?:s|ed)?|strikes?|missiles?|drones?|killed|explosions?|wars?|nuclear|uranium|'
+    r'execut(?:e|ed|es|ion|ions)|sanction(?:s|ed)?|protest(?:s|ed|ers?)?)\b|'
+    r'فوری|حمله|موشک|پهپاد|کشته|انفجار|جنگ|هسته|اعدام|تحریم|اعتراض',
+    re.I
+)
+_STOP_WORDS = frozenset({'a', 'an', 'the', 'and', 'or', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'news', 'report'})
+
+# --- TELEGRAM HTML ---
+# Same output as html.escape(s) in one C-level pass; hashtags also map ' ' to '_'
+_HTML_TABLE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#x27;'})
+_HASHTAG_TABLE = {**_HTML_TABLE, ord(' '): '_'}
+_ITEM_TMPL = (
+    "{icon} {hidden_image}<b><a href='{url}'>{title}</a></b>\n"
+    "🗞 <i>منبع: {source}</i>\n\n"
+    "📝 <b>تحلیل:</b>\n{summary}\n\n"
+    "🎯 <b>تأثیر:</b> {impact}\n\n"
+    "#{tag}\n"
+    "〰️〰️〰️〰️〰️〰️〰️\n\n"
+).format
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger()
 
+# --- JSON (orjson when available, stdlib otherwise) ---
+def _json_loads(raw):
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+def _json_dumps(obj, pretty=False):
+    if orjson: return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else 0)
+    return json.dumps(obj, indent=2 if pretty else None, ensure_ascii=False).encode('utf-8')
+
+def _write_atomic(path, data):
+    # Write beside the target and rename over it: a crash mid-write leaves
+    # the previous file intact instead of a truncated one
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f: f.write(data)
+    os.replace(tmp, path)
+
+def _parse_ai_json(content):
+    try: return _json_loads(content)
+    except ValueError: pass
+    # Model wrapped the object in a ``` / ```json fence
+    if '```' in content:
+        fenced = content.partition('```')[2]
+        if fenced.startswith('json'): fenced = fenced[4:]
+        try: return _json_loads(fenced.partition('```')[0].strip())
+        except ValueError: pass
+    # Prose around the JSON: slice from the first opening bracket to its last closer
+    starts = [i for i in (content.find('{'), content.find('[')) if i >= 0]
+    if not starts: raise ValueError("No JSON in AI reply")
+    start = min(starts)
+    end = content.rfind('}' if content[start] == '{' else ']')
+    return _json_loads(content[start:end + 1])
+
+# Query parameters that only track the click, never select the article
+_TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ocid', 'cmpid')
+
+def _canonical_url(url):
+    # Dedup key: lowercase scheme/host, no default port, fragment, trailing
+    # slash or tracking params; remaining params sorted
+    try: p = urlsplit(url)
+    except ValueError: return url
+    netloc = p.netloc.lower()
+    if (p.scheme.lower(), netloc.rpartition(':')[2]) in (('http', '80'), ('https', '443')):
+        netloc = netloc.rpartition(':')[0]
+    query = sorted((k, v) for k, v in parse_qsl(p.query, keep_blank_values=True) if not k.lower().startswith(_TRACKING_PARAMS))
+    return urlunsplit((p.scheme.lower(), netloc, p.path.rstrip('/'), urlencode(query), ''))
+
+def _decode_gnews_url(url):
+    # Older Google News article ids are base64 protobufs embedding the
+    # publisher URL; newer ones (AU_yqL...) only resolve server side
+    _, sep, rest = url.partition('/articles/')
+    if not sep: return None
+    token = rest.split('?', 1)[0].split('/', 1)[0]
+    try: raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except ValueError: return None
+    start = raw.find(b'http')
+    if start < 2: return None
+    # Field 4 (tag 0x22), length as a one- or two-byte varint
+    if raw[start - 2] == 0x22 and raw[start - 1] < 0x80: length = raw[start - 1]
+    elif start >= 3 and raw[start - 3] == 0x22 and raw[start - 2] >= 0x80: length = (raw[start - 2] & 0x7f) | (raw[start - 1] << 7)
+    else: return None
+    target = raw[start:start + length]
+    if len(target) != length: return None
+    try: return target.decode('ascii')
+    except UnicodeDecodeError: return None
+
+def _headline(title):
+    # GNews/Bing titles end in " - Publisher"; drop that tail
+    return title.rsplit(' - ', 1)[0]
+
+# --- DATES ---
+def _parse_timestamp(value):
+    # Feeds send RFC 822 (GNews/Bing) or ISO 8601 (DDG); dateutil only as a last resort
+    try: return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError): pass
+    try: return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError): pass
+    try:
+        # Rarely reached; import only when a feed sends an odd date format
+        from dateutil import parser
+        return parser.parse(value).timestamp()
+    except (TypeError, ValueError, OverflowError): return time.time()
+
+# --- AI PROMPTS ---
+_ANALYST_ROLE = "You are a Strategic Analyst for the Iranian Opposition (Pro-Pahlavi/Nationalist). "
+_REGIME_INSTRUCTION = (
+    "WARNING: The input text is from Iranian State Media (Propaganda). "
+    "You must DEBUNK it in your Persian summary. Identify hidden agendas. "
+    "Do not repeat their claims as facts. "
+)
+_LANGUAGE_RULES = (
+    "LANGUAGE RULES (CRITICAL): \n"
+    "1. THE JSON OUTPUT VALUES MUST BE IN PERSIAN (FARSI) ONLY. NO ENGLISH.\n"
+    "2. If the input is English, TRANSLATE your analysis to Persian.\n"
+    "3. 'tag' must be one Persian word.\n"
+)
+_ITEM_FIELDS = "title_fa, summary[3 bullet points], impact(1 sentence), tag(1 word), urgency(1-10), sentiment(-1.0 to 1.0)"
+_SYSTEM_PROMPT = (
+    _ANALYST_ROLE
+    + "TASK: Analyze the news news via Iran's National Interest.\n"
+    + _LANGUAGE_RULES
+    + "OUTPUT FORMAT JSON: {" + _ITEM_FIELDS + "}."
+)
+_SYSTEM_PROMPT_REGIME = _SYSTEM_PROMPT.replace(_ANALYST_ROLE, _ANALYST_ROLE + _REGIME_INSTRUCTION, 1)
+_BATCH_SYSTEM_PROMPT = (
+    _ANALYST_ROLE
+    + "TASK: Analyze each news item via Iran's National Interest.\n"
+    + "INPUT: a JSON array of items {id, headline, source, state_media, text}.\n"
+    + "For items with state_media true: " + _REGIME_INSTRUCTION + "\n"
+    + _LANGUAGE_RULES
+    + "OUTPUT FORMAT JSON: an array with exactly one object per input item: {id, " + _ITEM_FIELDS + "}."
+)
+
+# Salts the AI cache keys: editing any prompt invalidates replies cached under the old one
+_PROMPT_SALT = hashlib.blake2b(
+    '\0'.join((_SYSTEM_PROMPT, _SYSTEM_PROMPT_REGIME, _BATCH_SYSTEM_PROMPT)).encode('utf-8'), digest_size=16
+).digest()
+
+def _check_ai_item(data):
+    if not isinstance(data, dict) or not data.get('title_fa') or not data.get('summary'):
+        raise ValueError("Empty fields in AI response")
+
+def _check_ai_batch(data):
+    if not isinstance(data, list): raise ValueError("AI batch reply is not a JSON array")
+
 class IranNewsRadar:
+    # Article text only ever comes from <body>; skip building <head> (scripts, styles, meta)
+    BODY_STRAINER = SoupStrainer('body')
+    # Market pages: build only the one element each rate is read from
+    USD_STRAINER = SoupStrainer('input', attrs={'data-curr': 'tmn'})
+    OIL_STRAINER = SoupStrainer(class_='last_price')
+    # Untrusted feed XML: no entity expansion or network lookups, tolerate junk
+    RSS_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, recover=True)
+
     def __init__(self):
         self.scraper = cloudscraper.create_scraper(browser='chrome') 
+        self._tune_scraper_pool()
         self.api_key = CONFIG['POLLINATIONS_KEY']
+        # Send times of the last AI_RPM Pollinations requests (sliding window)
+        self._ai_calls = collections.deque(maxlen=CONFIG['AI_RPM'])
+        # Circuit breaker state: consecutive failed AI calls, fail-fast deadline
+        self._ai_failures = 0
+        self._ai_open_until = 0.0
+        # Items lost to AI or task failures this run (see run())
+        self._failed_items = 0
         self.existing_news = self._load_existing_news()
+        self.feed_validators = self._load_feed_validators()
         
-        self.seen_urls = {item.get('url') for item in self.existing_news if item.get('url')}
+        self.seen_urls = {_canonical_url(u) for item in self.existing_news for u in (item.get('url'), item.get('feed_url')) if u}
+        self._inflight_urls = set()
+        # Every URL ever accepted, beyond the 100-item news.json window,
+        # plus the AI reply cache
+        self.history = self._open_history()
         self.seen_titles = {self._normalize_text(item.get('title_en', '')) for item in self.existing_news}
-        
-        self.gnews_en = GNews(language='en', country='US', period='1h', max_results=5)
+
+        # Token sets kept parallel to existing_news, plus an inverted index
+        # token -> positions used to block fuzzy dedup candidates
+        self._existing_tokens = []
+        self._title_index = {}
+        for item in self.existing_news:
+            self._index_title(item.get('title', item.get('title_en', '')))
+
+    def _tune_scraper_pool(self):
+        # Keep cloudscraper's TLS adapters (they carry its cipher suite) and only
+        # widen their pools: market fetches and Cloudflare fallbacks share this
+        # session across threads. GETs also retry transient 5xx. Not 429/503:
+        # cloudscraper spots Cloudflare challenges by those statuses and must
+        # see them first. Retry-After is ignored so no server can stretch a
+        # request past its timeout (a fallback thread would outlive wait_for).
+        retry = Retry(total=2, backoff_factor=0.3, status_forcelist=(500, 502, 504),
+                      respect_retry_after_header=False, raise_on_status=False)
+        for adapter in self.scraper.adapters.values():
+            adapter.max_retries = retry
+            adapter.init_poolmanager(32, CONFIG['FETCH_CONCURRENCY'])
 
     def _normalize_text(self, text):
         if not text: return ""
-        return re.sub(r'\W+', '', text).lower()
+        if text.isascii(): return text.translate(_NORM_TABLE).lower()
+        return _WORD_RE.sub('', text).lower()
 
     def _get_tokens(self, text):
-        stop_words = {'a', 'an', 'the', 'and', 'or', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'news', 'report'}
         if not text: return set()
-        clean = re.sub(r'[^\w\s]', '', text.lower())
-        words = set(clean.split())
-        return words - stop_words
+        return set(_PUNCT_RE.sub('', text.lower()).split()) - _STOP_WORDS
+
+    def _index_title(self, title, token_sets=None, index=None):
+        # Defaults to the existing-news index; run() passes its own batch pair
+        if token_sets is None: token_sets, index = self._existing_tokens, self._title_index
+        tokens = frozenset(self._get_tokens(title))
+        idx = len(token_sets)
+        token_sets.append(tokens)
+        for token in tokens:
+            index.setdefault(token, set()).add(idx)
 
-    def _is_duplicate_fuzzy(self, new_title, comparison_pool):
+    def _is_duplicate_fuzzy(self, new_title, batch=None):
         new_tokens = self._get_tokens(new_title)
         if not new_tokens: return False
 
-        for item in comparison_pool:
-            existing_title = item.get('title', item.get('title_en', ''))
-            existing_tokens = self._get_tokens(existing_title)
-            if not existing_tokens: continue
+        pools = [(self._existing_tokens, self._title_index)]
+        if batch: pools.append(batch)
 
-            intersection = new_tokens.intersection(existing_tokens)
-            union = new_tokens.union(existing_tokens)
-            if not union: continue
-            
-            similarity = len(intersection) / len(union)
-            if similarity > 0.35 or len(intersection) >= 4:
-                return True
+        n_new = len(new_tokens)
+        for token_sets, index in pools:
+            # Only items sharing at least one token can pass either threshold
+            candidates = set()
+            for token in new_tokens:
+                candidates.update(index.get(token, ()))
+
+            for idx in candidates:
+                existing_tokens = token_sets[idx]
+
+                # Size filter: Jaccard <= min/max and the overlap is at most min,
+                # so lopsided pairs can be rejected before intersecting
+                n_small, n_large = sorted((n_new, len(existing_tokens)))
+                if n_small < 4 and n_small / n_large <= 0.35: continue
+
+                # Jaccard from cardinalities alone: |A ∪ B| = |A| + |B| - |A ∩ B|
+                inter = len(new_tokens & existing_tokens)
+                union = n_new + len(existing_tokens) - inter
+                if inter >= 4 or inter / union > 0.35:
+                    return True
         return False
 
+    def _load_feed_validators(self):
+        try:
+            with open(CONFIG['FILES']['FEEDS'], 'rb') as f:
+                data = _json_loads(f.read())
+                return data if isinstance(data, dict) else {}
+        except (OSError, ValueError): return {}
+
+    def _open_history(self):
+        db = sqlite3.connect(CONFIG['FILES']['HISTORY'])
+        db.execute("PRAGMA journal_mode=WAL")
+        # WITHOUT ROWID: the url primary key is the table's own B-tree, no second index
+        db.execute("CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY, ts INTEGER NOT NULL) WITHOUT ROWID")
+        # AI replies keyed by a digest of headline + text (reprints); used orders the LRU
+        db.execute("CREATE TABLE IF NOT EXISTS ai_cache (key TEXT PRIMARY KEY, reply BLOB NOT NULL, used REAL NOT NULL) WITHOUT ROWID")
+        return db
+
+    def _record_history(self, items):
+        now = int(time.time())
+        urls = {_canonical_url(u) for item in items for u in (item['url'], item['feed_url']) if u}
+        with self.history:
+            self.history.executemany("INSERT OR IGNORE INTO seen (url, ts) VALUES (?, ?)", [(u, now) for u in urls])
+            # Feeds only look back a day; older history just grows the file
+            self.history.execute("DELETE FROM seen WHERE ts < ?", (now - CONFIG['HISTORY_DAYS'] * 86400,))
+
+    def _save_ai_cache(self):
+        # Commits this run's puts and hits, keeping the AI_CACHE_SIZE most recently used
+        with self.history:
+            self.history.execute(
+                "DELETE FROM ai_cache WHERE key NOT IN (SELECT key FROM ai_cache ORDER BY used DESC LIMIT ?)",
+                (CONFIG['AI_CACHE_SIZE'],))
+
+    async def _fetch_feed(self, session, url):
+        # Conditional GET: an unchanged feed answers 304 and is never parsed.
+        # Returns None in that case (its items were handled last run).
+        cached = self.feed_validators.get(url, {})
+        headers = {}
+        if cached.get('etag'): headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'): headers['If-Modified-Since'] = cached['last_modified']
+
+        async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=CONFIG['TIMEOUT'])) as resp:
+            if resp.status == 304:
+                logger.info(f"Feed unchanged: {url[:60]}")
+                return None
+            raw = await resp.read()
+            if resp.status == 200:
+                validators = {'etag': resp.headers.get('ETag'), 'last_modified': resp.headers.get('Last-Modified')}
+                if any(validators.values()): self.feed_validators[url] = validators
+                else: self.feed_validators.pop(url, None)
+        return raw
+
     def _load_existing_news(self):
-        if not os.path.exists(CONFIG['FILES']['NEWS']): return []
         try:
-            with open(CONFIG['FILES']['NEWS'], 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            with open(CONFIG['FILES']['NEWS'], 'rb') as f:
+                data = _json_loads(f.read())
                 return data if isinstance(data, list) else []
-        except: return []
+        except OSError: return []
+        except ValueError:
+            # Keep the unreadable file for inspection before the window is rewritten
+            logger.error(f"{CONFIG['FILES']['NEWS']} is corrupt; saved a copy as .bak")
+            shutil.copyfile(CONFIG['FILES']['NEWS'], CONFIG['FILES']['NEWS'] + '.bak')
+            return []
 
     # --- PROXIES & MARKET ---
-    def fetch_best_proxies(self):
+    async def fetch_best_proxies(self):
+        # Plain GitHub raw file: no Cloudflare challenge, so no cloudscraper
         try:
-            resp = self.scraper.get(CONFIG['PROXY_URL'], timeout=10)
-            if resp.status_code != 200: return []
-            data = resp.json()
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+                async with session.get(CONFIG['PROXY_URL']) as resp:
+                    if resp.status != 200: return []
+                    data = _json_loads(await resp.read())
             online = [p for p in data if p.get('status') == 'Online']
-            online.sort(key=lambda x: x.get('latency') if x.get('latency') is not None else 99999)
-            return online[:9]
-        except: return []
+            return heapq.nsmallest(9, online, key=lambda x: x.get('latency') if x.get('latency') is not None else 99999)
+        # TypeError: latency values of mixed types in the sort key
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, AttributeError, TypeError): return []
 
-    def fetch_market_rates(self):
-        data = {"usd": "نامشخص", "oil": "نامشخص", "updated": "--:--"}
+    def _fetch_usd(self):
         try:
             resp = self.scraper.get("https://alanchand.com/en/currencies-price/usd", timeout=10)
             if resp.status_code == 200:
-                soup = BeautifulSoup(resp.text, 'html.parser')
+                soup = BeautifulSoup(resp.content, 'lxml', parse_only=self.USD_STRAINER)
                 usd = soup.find('input', attrs={'data-curr': 'tmn'})
                 if usd:
                     val = usd.get('data-price') or usd.get('value')
-                    if val: data["usd"] = f"{int(int(val.replace(',', '')) / 10):,}"
-        except: pass
+                    if val: return "usd", f"{int(int(val.replace(',', '')) / 10):,}"
+        except (requests.RequestException, cloudscraper.exceptions.CloudflareException, ValueError, AttributeError): pass
+        return None
+
+    def _fetch_oil(self):
         try:
             resp = self.scraper.get("https://oilprice.com/oil-price-charts/46", timeout=10)
-            soup = BeautifulSoup(resp.text, 'html.parser')
+            soup = BeautifulSoup(resp.content, 'lxml', parse_only=self.OIL_STRAINER)
             oil = soup.select_one(".last_price")
-            if oil: data["oil"] = oil.get_text().strip()
-        except: pass
+            if oil: return "oil", oil.get_text().strip()
+        except (requests.RequestException, cloudscraper.exceptions.CloudflareException, ValueError, AttributeError): pass
+        return None
+
+    def fetch_market_rates(self):
+        data = {"usd": "نامشخص", "oil": "نامشخص", "updated": "--:--"}
+        # The two sources are unrelated; fetch and parse them side by side
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as exc:
+            for res in exc.map(lambda fetch: fetch(), (self._fetch_usd, self._fetch_oil)):
+                if res: data[res[0]] = res[1]
         data["updated"] = time.strftime("%H:%M")
         return data
 
     # --- NEWS FETCHING ---
-    def fetch_gnews(self):
+    def _rss_items(self, raw):
+        # One localname -> text dict per <item>; feeds put their extras in
+        # namespaces whose URI varies (Bing embeds the query), so ignore it
+        root = etree.fromstring(raw, self.RSS_PARSER)
+        for item in root.iterfind('.//item'):
+            yield {etree.QName(c).localname.lower(): (c.text or '').strip() for c in item if isinstance(c.tag, str)}
+
+    async def fetch_gnews(self, session):
         results = []
         try:
-            results = self.gnews_en.get_news(CONFIG['SEARCH_QUERY'])
+            # Google News RSS directly; 'when:1h' is the search-side period filter
+            query = quote_plus(f"{CONFIG['SEARCH_QUERY']} when:1h")
+            url = f"https://news.google.com/rss/search?q={query}&hl=en-US&gl=US&ceid=US:en"
+            raw = await self._fetch_feed(session, url)
+            if raw is None: return results
+
+            for fields in self._rss_items(raw):
+                title = fields.get('title', '')
+                # <description> is an HTML link list; keep its text only
+                description = ' '.join(html.unescape(_TAG_RE.sub(' ', fields.get('description', ''))).split())
+                results.append({
+                    'title': title,
+                    'url': fields.get('link'),
+                    'publisher': {'title': fields.get('source') or 'Google News'},
+                    'published date': fields.get('pubdate'),
+                    'description': description or title,
+                })
+                if len(results) == CONFIG['GNEWS_MAX_RESULTS']: break
         except Exception as e:
             logger.error(f"GNews Error: {e}")
         return results
@@ -153,166 +498,361 @@ class IranNewsRadar:
             logger.error(f"DDG Error ({query}): {e}")
         return results
 
-    def fetch_bing_rss(self, query):
+    async def fetch_bing_rss(self, session, query):
         results = []
         try:
             encoded_query = quote(query)
             url = f"https://www.bing.com/news/search?q={encoded_query}&format=rss"
-            feed = feedparser.parse(url)
-            
-            for entry in feed.entries:
-                publisher = "Bing News"
-                if hasattr(entry, 'news_source'): publisher = entry.news_source
-                elif hasattr(entry, 'source') and hasattr(entry.source, 'title'): publisher = entry.source.title
+            raw = await self._fetch_feed(session, url)
+            if raw is None: return results
+
+            for fields in self._rss_items(raw):
+                title = fields.get('title', '')
+                publisher = fields.get('source') or "Bing News"
 
                 # Clean Redirects
-                final_link = entry.link
+                final_link = fields.get('link', '')
                 if "apiclick.aspx" in final_link:
-                    match = re.search(r'[?&]url=([^&]+)', final_link)
+                    match = _BING_URL_RE.search(final_link)
                     if match: final_link = unquote(match.group(1))
 
                 # Image Extraction
-                image_url = None
-                try:
-                    if hasattr(entry, 'news_image'):
-                        raw_url = entry.news_image
-                        width = getattr(entry, 'news_imagemaxwidth', '700')
-                        height = getattr(entry, 'news_imagemaxheight', '400')
-                        if '{0}' in raw_url:
-                            image_url = raw_url.replace('{0}', str(width)).replace('{1}', str(height))
-                        else:
-                            image_url = raw_url
-                except Exception:
-                    pass
+                image_url = fields.get('image') or None
+                if image_url and '{0}' in image_url:
+                    width = fields.get('imagemaxwidth', '700')
+                    height = fields.get('imagemaxheight', '400')
+                    image_url = image_url.replace('{0}', width).replace('{1}', height)
 
                 results.append({
-                    'title': entry.title,
+                    'title': title,
                     'url': final_link,
                     'publisher': {'title': publisher},
-                    'published date': entry.published,
-                    'description': entry.summary if hasattr(entry, 'summary') else entry.title,
+                    'published date': fields.get('pubdate'),
+                    'description': fields.get('description') or title,
                     'image': image_url
                 })
         except Exception as e:
             logger.error(f"Bing RSS Error: {e}")
         return results
 
-    def get_combined_news(self):
-        all_entries = []
-        all_entries.extend(self.fetch_gnews())
-        all_entries.extend(self.fetch_bing_rss(CONFIG['SEARCH_QUERY']))
-        all_entries.extend(self.fetch_duckduckgo(CONFIG['SEARCH_QUERY'], region='wt-wt'))
-        all_entries.extend(self.fetch_duckduckgo("ایران AND (آمریکا OR اسرائیل OR دلار OR جنگ)", region='ir-ir'))
+    async def get_combined_news(self):
+        # DDGS is a blocking library; run it in threads. Every DDG query
+        # hits the same host, so cap those in flight instead of sleeping.
+        ddg_sem = asyncio.Semaphore(CONFIG['DDG_CONCURRENCY'])
 
-        for domain in CONFIG['TARGET_SOURCES']:
-            try:
+        async def ddg(query, region='wt-wt'):
+            async with ddg_sem:
+                return await asyncio.to_thread(self.fetch_duckduckgo, query, region)
+
+        async with aiohttp.ClientSession(headers=self._session_headers()) as session:
+            tasks = [
+                self.fetch_gnews(session),
+                self.fetch_bing_rss(session, CONFIG['SEARCH_QUERY']),
+                ddg(CONFIG['SEARCH_QUERY'], region='wt-wt'),
+                ddg("ایران AND (آمریکا OR اسرائیل OR دلار OR جنگ)", region='ir-ir'),
+            ]
+            for domain in CONFIG['TARGET_SOURCES']:
                 query = f"site:{domain} Iran"
-                if any(x in domain for x in ['tasnim', 'fars', 'irna', 'bbc.com/persian', 'radiofarda']):
+                if _PERSIAN_SITE_RE.search(domain):
                     query = f"site:{domain} ایران"
-                site_res = self.fetch_duckduckgo(query, region='wt-wt')
-                all_entries.extend(site_res)
-                time.sleep(0.5) 
-            except: pass
+                tasks.append(ddg(query))
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        # gather keeps task order, so entries stay in the old source order
+        all_entries = []
+        for res in results:
+            if isinstance(res, list): all_entries.extend(res)
         return all_entries
 
     # --- PROCESSING ---
-    def _resolve_final_url(self, gnews_url):
-        if not gnews_url: return None
-        if "news.google.com" not in gnews_url: return gnews_url
-        try:
-            resp = self.scraper.get(gnews_url, allow_redirects=True, timeout=10, stream=True)
-            return resp.url
-        except: return gnews_url
+    def _is_seen_url(self, url):
+        key = _canonical_url(url)
+        if key in self.seen_urls: return True
+        # Rows written before canonicalization hold the raw URL
+        return self.history.execute("SELECT 1 FROM seen WHERE url IN (?, ?)", (key, url)).fetchone() is not None
 
-    def scrape_article_text(self, final_url, fallback_snippet):
+    def _claim_url(self, url):
+        # Different feed links (GNews redirects, tracking params) can land on
+        # the same article; only the first one claims it this run
+        key = _canonical_url(url)
+        if key in self._inflight_urls or self._is_seen_url(url): return False
+        self._inflight_urls.add(key)
+        return True
+
+    async def fetch_article(self, session, url, fallback_snippet):
+        # One GET both resolves GNews redirects and downloads the page. The
+        # landing URL is known from the headers, so duplicates stop before the
+        # body is read. Returns (final_url, text), or None to skip the item.
+        if not url: return None, fallback_snippet
+        # Feed links of stored items are in seen_urls too, so a GNews link
+        # handled by an earlier run is skipped without resolving it again
+        if not self._claim_url(url): return None
+        resolve = "news.google.com" in url  # direct links are final as given
+        if resolve:
+            # Read the publisher URL out of the link when it is embedded
+            decoded = _decode_gnews_url(url)
+            if decoded:
+                if _canonical_url(decoded) != _canonical_url(url) and not self._claim_url(decoded): return None
+                url, resolve = decoded, False
+        final_url, page, encoding, cf_blocked = url, None, None, False
+        # Without an AI key the body is never read; nothing to fetch for direct links
+        if not resolve and (not self.api_key or url.lower().endswith('.pdf')): return url, fallback_snippet
+
+        # One budget for the whole fetch, Cloudflare fallback included
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + CONFIG['FETCH_DEADLINE']
         try:
-            if final_url.lower().endswith('.pdf'): return fallback_snippet
-            resp = self.scraper.get(final_url, timeout=15)
-            soup = BeautifulSoup(resp.text, 'html.parser')
-            for tag in soup(["script", "style", "nav", "footer", "header", "form"]): tag.extract()
-            article_body = soup.find('div', class_=re.compile(r'(article|story|body|content)'))
-            if article_body:
-                text = article_body.get_text(separator=' ').strip()
-            else:
-                text = " ".join([p.get_text().strip() for p in soup.find_all('p')])
-            return text[:4500] if len(text) > 100 else fallback_snippet
-        except: return fallback_snippet
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=CONFIG['FETCH_DEADLINE'])) as resp:
+                if resolve:
+                    final_url = str(resp.url)
+                    if _canonical_url(final_url) != _canonical_url(url) and not self._claim_url(final_url): return None
+                # Headers are in before any body byte: skip PDFs, video and other non-HTML
+                content_type = resp.headers.get('Content-Type', '').lower()
+                is_html = 'html' in content_type if content_type else not final_url.lower().endswith('.pdf')
+                if self.api_key and is_html:
+                    cf_blocked = resp.status == 403
+                    if not cf_blocked:
+                        buf = bytearray()
+                        async for chunk in resp.content.iter_chunked(16384):
+                            buf += chunk
+                            if len(buf) >= CONFIG['MAX_PAGE_BYTES']: break
+                        page, encoding = bytes(buf), resp.charset
+            if cf_blocked:
+                # Cloudflare challenge: let cloudscraper solve it off the event loop
+                remaining = deadline - loop.time()
+                if remaining > 1:
+                    page, encoding = await asyncio.wait_for(asyncio.to_thread(self._fetch_page_capped, final_url, remaining), remaining)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError,
+                requests.RequestException, cloudscraper.exceptions.CloudflareException): pass
 
-    def analyze_with_ai(self, headline, full_text, source_name):
-        if not self.api_key: return None
-        context = full_text if len(full_text) > 100 else headline
-        
-        is_regime = any(x in source_name.lower() for x in ['tasnim', 'fars', 'irna', 'press', 'mehr'])
-        
-        regime_instruction = ""
-        if is_regime:
-            regime_instruction = (
-                "WARNING: The input text is from Iranian State Media (Propaganda). "
-                "You must DEBUNK it in your Persian summary. Identify hidden agendas. "
-                "Do not repeat their claims as facts. "
-            )
+        if page is None: return final_url, fallback_snippet
+        # Bad markup or a bogus declared charset: keep the feed snippet
+        # Parsing is CPU work; keep it off the event loop like the fetches
+        try: return final_url, await asyncio.to_thread(self._extract_article_text, page, encoding, fallback_snippet)
+        except (ValueError, LookupError, etree.LxmlError): return final_url, fallback_snippet
+
+    def _fetch_page_capped(self, url, timeout=15):
+        with self.scraper.get(url, timeout=timeout, stream=True) as resp:
+            buf = bytearray()
+            for chunk in resp.iter_content(chunk_size=16384):
+                buf += chunk
+                if len(buf) >= CONFIG['MAX_PAGE_BYTES']: break
+            # requests guesses ISO-8859-1 when no charset is sent; let the parser sniff instead
+            declared = 'charset' in resp.headers.get('Content-Type', '').lower()
+            return bytes(buf), resp.encoding if declared else None
+
+    def _extract_article_text(self, page, encoding, fallback_snippet):
+        # Stub pages (consent walls, JS redirects) can't carry an article; skip the parse
+        if len(page) < CONFIG['MIN_PAGE_BYTES']: return fallback_snippet
+        if not _CONTAINER_PROBE_RE.search(page):
+            return self._paragraph_text(page, encoding, fallback_snippet)
+        soup = BeautifulSoup(page, 'lxml', parse_only=self.BODY_STRAINER, from_encoding=encoding)
+        # One traversal collects all six tag kinds; decompose frees them instead of re-parenting
+        for tag in soup(["script", "style", "nav", "footer", "header", "form"]): tag.decompose()
+        article_body = soup.find(attrs={'itemprop': 'articleBody'}) or soup.find('div', class_=_ARTICLE_CLASS_RE)
+        if not article_body: return self._paragraph_text(page, encoding, fallback_snippet)
+        text = article_body.get_text(separator=' ').strip()
+        return text[:4500] if len(text) > 100 else fallback_snippet
 
-        system_prompt = (
-            "You are a Strategic Analyst for the Iranian Opposition (Pro-Pahlavi/Nationalist). "
-            f"{regime_instruction}"
-            "TASK: Analyze the news news via Iran's National Interest.\n"
-            "LANGUAGE RULES (CRITICAL): \n"
-            "1. THE JSON OUTPUT VALUES MUST BE IN PERSIAN (FARSI) ONLY. NO ENGLISH.\n"
-            "2. If the input is English, TRANSLATE your analysis to Persian.\n"
-            "3. 'tag' must be one Persian word.\n"
-            "OUTPUT FORMAT JSON: {title_fa, summary[3 bullet points], impact(1 sentence), tag(1 word), urgency(1-10), sentiment(-1.0 to 1.0)}."
-        )
+    def _paragraph_text(self, page, encoding, fallback_snippet):
+        # No article container: walk <p> bodies straight from the bytes, no DOM,
+        # and stop as soon as the 4500 characters the AI gets are collected
+        # No header charset: use the page's own <meta charset> like lxml would
+        encoding = encoding or EncodingDetector.find_declared_encoding(page, is_html=True) or 'utf-8'
+        try: codecs.lookup(encoding)
+        except LookupError: encoding = 'utf-8'
+        page = _SCRIPT_STYLE_RE.sub(b' ', page)
+        parts, total = [], 0
+        for match in _PARAGRAPH_RE.finditer(page):
+            para = ' '.join(html.unescape(_TAG_RE.sub(' ', match.group(1).decode(encoding, 'replace'))).split())
+            if not para: continue
+            parts.append(para)
+            total += len(para) + 1
+            if total >= 4500: break
+        text = ' '.join(parts)
+        return text[:4500] if len(text) > 100 else fallback_snippet
 
+    def _ai_cache_key(self, headline, context, is_regime):
+        # Syndicated reprints share the headline and lede, not necessarily the
+        # tail; the headline also keeps site boilerplate from colliding across
+        # stories. The regime flag changes the prompt, so it is part of the key.
+        fingerprint = f"{' '.join(headline.lower().split())}|{' '.join(context[:500].split())}"
+        return hashlib.blake2b(fingerprint.encode('utf-8', 'ignore'), digest_size=8, salt=_PROMPT_SALT, person=b'regime' if is_regime else b'').hexdigest()
+
+    def _ai_cache_get(self, key):
+        row = self.history.execute("SELECT reply FROM ai_cache WHERE key = ?", (key,)).fetchone()
+        if row is None: return None
+        self.history.execute("UPDATE ai_cache SET used = ? WHERE key = ?", (time.time(), key))
+        return _json_loads(row[0])
+
+    def _ai_cache_put(self, key, data):
+        self.history.execute("INSERT OR REPLACE INTO ai_cache (key, reply, used) VALUES (?, ?, ?)", (key, _json_dumps(data), time.time()))
+
+    async def _ai_throttle(self):
+        # Stay under AI_RPM requests per rolling minute instead of waiting
+        # for 429s; runs on the event loop only, so no lock is needed
+        loop = asyncio.get_running_loop()
+        while len(self._ai_calls) == self._ai_calls.maxlen:
+            wait = 60 - (loop.time() - self._ai_calls[0])
+            if wait <= 0: break
+            await asyncio.sleep(wait)
+        self._ai_calls.append(loop.time())
+
+    def _ai_breaker_open(self):
+        # After AI_BREAKER_THRESHOLD failed calls in a row, fail fast for
+        # AI_BREAKER_RESET seconds, then let a single probe call through
+        if self._ai_failures < CONFIG['AI_BREAKER_THRESHOLD']: return False
+        now = time.monotonic()
+        if now < self._ai_open_until: return True
+        self._ai_open_until = now + CONFIG['AI_BREAKER_RESET']
+        return False
+
+    async def _post_ai(self, session, payload, check, timeout):
+        # One Pollinations chat completion with retries; returns the parsed JSON
+        # reply once check() accepts it (check raises ValueError otherwise)
+        if self._ai_breaker_open(): return None
+        data, transient = await self._post_ai_attempts(session, payload, check, timeout)
+        # Only outages trip the breaker; a 4xx or a malformed reply means
+        # the service is up and answering
+        if data is not None or not transient:
+            self._ai_failures = 0
+            return data
+        self._ai_failures += 1
+        if self._ai_failures >= CONFIG['AI_BREAKER_THRESHOLD']:
+            if self._ai_failures == CONFIG['AI_BREAKER_THRESHOLD']:
+                logger.warning(f"AI failed {self._ai_failures} times in a row; pausing AI calls")
+            self._ai_open_until = time.monotonic() + CONFIG['AI_BREAKER_RESET']
+        return None
+
+    async def _post_ai_attempts(self, session, payload, check, timeout):
+        # Returns (data, transient): transient is True when the last failure
+        # was a 408/429/5xx, a timeout or a connection error
+        delay, transient = 0, False
         for attempt in range(CONFIG['AI_RETRIES']):
+            # Full-jitter exponential backoff: retry n sleeps up to min(8, 2**n)s
+            # (2s then 4s with AI_RETRIES=3) so parallel callers that failed
+            # together don't retry in lockstep
+            if attempt: await asyncio.sleep(delay or random.uniform(0, min(8, 2 ** attempt)))
+            delay = 0
+            await self._ai_throttle()
             try:
-                resp = self.scraper.post(
+                async with session.post(
                     "https://gen.pollinations.ai/v1/chat/completions",
                     headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
-                    json={
-                        "model": "openai",
-                        "messages": [
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": f"HEADLINE: {headline}\nSOURCE: {source_name}\nTEXT: {context}"}
-                        ],
-                        "temperature": 0.3
-                    }, timeout=30
-                )
-                
-                if resp.status_code == 200:
-                    raw_content = resp.json()['choices'][0]['message']['content']
-                    clean = raw_content.replace('```json','').replace('```','').strip()
-                    data = json.loads(clean)
-                    
-                    if not data.get('title_fa') or not data.get('summary'):
-                        raise ValueError("Empty fields in AI response")
-                        
-                    return data
-                else:
-                    logger.warning(f"AI Error Status: {resp.status_code}")
-                    
-            except Exception as e:
-                logger.warning(f"AI Attempt {attempt+1} failed: {e}")
-                time.sleep(2)
+                    data=payload, timeout=aiohttp.ClientTimeout(total=timeout)
+                ) as resp:
+                    if resp.status != 200:
+                        logger.warning(f"AI Error Status: {resp.status}")
+                        # Bad key or rejected body: the same request fails again
+                        if 400 <= resp.status < 500 and resp.status not in (408, 429): return None, False
+                        transient = True
+                        # Honour the server's Retry-After on 429/503
+                        try: delay = min(float(resp.headers.get('Retry-After', 0)), 60)
+                        except ValueError: delay = 0
+                        continue
+                    body = _json_loads(await resp.read())
 
-        return None
+                data = _parse_ai_json(body['choices'][0]['message']['content'])
+                check(data)
+                return data, False
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"AI Attempt {attempt+1} failed: {e!r}")
+                transient = True
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                logger.warning(f"AI Attempt {attempt+1} bad reply: {e}")
+                transient = False
+
+        return None, transient
+
+    async def analyze_with_ai(self, session, headline, full_text, source_name):
+        if not self.api_key: return None
+        context = full_text if len(full_text) > 100 else headline
+        is_regime = bool(_REGIME_RE.search(source_name.lower()))
+
+        key = self._ai_cache_key(headline, context, is_regime)
+        cached = self._ai_cache_get(key)
+        if cached is not None: return cached
+
+        # Serialized once, reused across retries
+        payload = _json_dumps({
+            "model": "openai",
+            "messages": [
+                {"role": "system", "content": _SYSTEM_PROMPT_REGIME if is_regime else _SYSTEM_PROMPT},
+                {"role": "user", "content": f"HEADLINE: {headline}\nSOURCE: {source_name}\nTEXT: {context}"}
+            ],
+            "temperature": 0.3
+        })
+
+        data = await self._post_ai(session, payload, _check_ai_item, CONFIG['AI_TIMEOUT'])
+        if data is not None: self._ai_cache_put(key, data)
+        return data
+
+    async def analyze_batch_with_ai(self, session, items):
+        # items: (headline, full_text, source_name) tuples. Uncached items share
+        # one request; any the batch reply misses fall back to single calls.
+        # Returns the AI dicts (or None) in input order.
+        if not self.api_key: return [None] * len(items)
+        results, pending = [None] * len(items), []
+        for i, (headline, full_text, source_name) in enumerate(items):
+            context = full_text if len(full_text) > 100 else headline
+            is_regime = bool(_REGIME_RE.search(source_name.lower()))
+            key = self._ai_cache_key(headline, context, is_regime)
+            results[i] = self._ai_cache_get(key)
+            if results[i] is None: pending.append((i, key, context, is_regime))
+
+        if len(pending) > 1:
+            batch = [
+                {"id": i, "headline": items[i][0], "source": items[i][2], "state_media": is_regime, "text": context}
+                for i, _, context, is_regime in pending
+            ]
+            payload = _json_dumps({
+                "model": "openai",
+                "messages": [
+                    {"role": "system", "content": _BATCH_SYSTEM_PROMPT},
+                    {"role": "user", "content": _json_dumps(batch).decode('utf-8')}
+                ],
+                "temperature": 0.3
+            })
+            reply = await self._post_ai(session, payload, _check_ai_batch, CONFIG['AI_TIMEOUT'] * 2)
+            by_id = {str(r.pop('id', None)): r for r in reply or () if isinstance(r, dict)}
 
-    def process_item(self, entry):
-        raw_title = entry.get('title', '').rsplit(' - ', 1)[0]
+            missed = []
+            for i, key, context, is_regime in pending:
+                data = by_id.get(str(i))
+                try: _check_ai_item(data)
+                except ValueError:
+                    missed.append((i, key, context, is_regime))
+                    continue
+                results[i] = data
+                self._ai_cache_put(key, data)
+            pending = missed
+
+        singles = await asyncio.gather(*(self.analyze_with_ai(session, *items[i]) for i, *_ in pending))
+        for (i, *_), data in zip(pending, singles): results[i] = data
+        return results
+
+    async def prepare_item(self, session, fetch_sem, entry):
+        # Fetch stage: dedup and download. Returns the inputs for the AI stage.
+        raw_title = entry.get('headline') or _headline(entry.get('title', ''))
         publisher = entry.get('publisher', {}).get('title', 'Unknown')
-        image_url = entry.get('image')
-        
-        logger.info(f"Processing: {publisher} | {raw_title[:20]}...")
         
-        final_url = self._resolve_final_url(entry.get('url'))
-        if final_url in self.seen_urls: return None
-        if self._normalize_text(raw_title) in self.seen_titles: return None
-        
-        snippet = entry.get('description', raw_title)
-        text = self.scrape_article_text(final_url, snippet)
-        
-        ai = self.analyze_with_ai(raw_title, text, publisher)
+        async with fetch_sem:
+            logger.info(f"Processing: {publisher} | {raw_title[:20]}...")
+
+            if self._normalize_text(raw_title) in self.seen_titles: return None
+
+            snippet = entry.get('description', raw_title)
+            fetched = await self.fetch_article(session, entry.get('url'), snippet)
+            if fetched is None: return None
+            final_url, text = fetched
+        return entry, raw_title, publisher, snippet, final_url, text
+
+    def _build_item(self, prepared, ai):
+        entry, raw_title, publisher, snippet, final_url, _ = prepared
         if not ai: 
             logger.info("Skipping item due to AI failure.")
+            self._failed_items += 1
             return None
         
         # --- FIX: Safe integer conversion for urgency ---
@@ -321,33 +861,116 @@ class IranNewsRadar:
         except (ValueError, TypeError):
             urgency_val = 3
 
-        try: ts = parser.parse(entry.get('published date')).timestamp()
-        except: ts = time.time()
+        ts = _parse_timestamp(entry.get('published date'))
+        # Models sometimes answer a single string; store a list of strings
+        summary = ai.get('summary') or [snippet]
+        if isinstance(summary, str): summary = [summary]
 
         return {
             "title_fa": ai.get('title_fa', raw_title),
             "title_en": raw_title,
-            "summary": ai.get('summary', [snippet]),
-            "impact": ai.get('impact', '...'),
-            "tag": ai.get('tag', 'General'),
+            "summary": [str(x) for x in summary],
+            "impact": str(ai.get('impact', '...')),
+            "tag": str(ai.get('tag', 'General')),
             "urgency": urgency_val, # Using safe integer
             "source": publisher,
             "url": final_url,
-            "image": image_url,
+            "feed_url": entry.get('url'),
+            "image": entry.get('image'),
             "timestamp": ts
         }
 
-    def send_digest_to_telegram(self, items):
+    async def _ai_batches(self, queue):
+        # Group items leaving the fetch stage: up to AI_BATCH_SIZE per batch,
+        # waiting at most AI_BATCH_WAIT seconds for stragglers. None ends it.
+        loop = asyncio.get_running_loop()
+        # The pending get() outlives a timeout (shielded) and opens the next
+        # batch, so an item arriving right at the deadline is never dropped
+        getter = None
+        while True:
+            first = await (getter or queue.get())
+            getter = None
+            if first is None: return
+            batch, deadline = [first], loop.time() + CONFIG['AI_BATCH_WAIT']
+            while len(batch) < CONFIG['AI_BATCH_SIZE']:
+                getter = getter or asyncio.ensure_future(queue.get())
+                try: item = await asyncio.wait_for(asyncio.shield(getter), deadline - loop.time())
+                except asyncio.TimeoutError: break
+                getter = None
+                if item is None:
+                    yield batch
+                    return
+                batch.append(item)
+            yield batch
+
+    def _session_headers(self):
+        # Browser headers from cloudscraper; aiohttp negotiates its own encoding
+        return {k: v for k, v in self.scraper.headers.items() if k.lower() != 'accept-encoding'}
+
+    async def _process_batch(self, entries):
+        # Semaphores must be created inside the running loop (Python 3.9)
+        fetch_sem = asyncio.Semaphore(CONFIG['FETCH_CONCURRENCY'])
+        ai_sem = asyncio.Semaphore(CONFIG['AI_CONCURRENCY'])
+        connector = aiohttp.TCPConnector(limit=CONFIG['FETCH_CONCURRENCY'], ttl_dns_cache=300)
+        # Pollinations gets its own pool so AI calls never queue behind page fetches
+        # One host for the whole stage: keep its address past aiohttp's 10s default
+        ai_connector = aiohttp.TCPConnector(limit=CONFIG['AI_CONCURRENCY'], ttl_dns_cache=300)
+
+        new_items = []
+        # No cookies from the scraper: its jar only holds market-site cookies,
+        # and aiohttp would send constructor cookies to every host
+        async with aiohttp.ClientSession(connector=connector, headers=self._session_headers()) as session, \
+                aiohttp.ClientSession(connector=ai_connector) as ai_session:
+            # Fetched items flow through a queue into batched AI calls
+            queue = asyncio.Queue()
+
+            async def fetch(entry):
+                prepared = await self.prepare_item(session, fetch_sem, entry)
+                if prepared: queue.put_nowait(prepared)
+
+            async def fetch_all():
+                results = await asyncio.gather(*(fetch(e) for e in entries), return_exceptions=True)
+                queue.put_nowait(None)
+                for err in results:
+                    if isinstance(err, Exception):
+                        logger.error("Fetch task failed", exc_info=err)
+                        self._failed_items += 1
+
+            async def analyze(batch):
+                # AI calls are pure network waits; cap them separately from page fetches
+                async with ai_sem:
+                    replies = await self.analyze_batch_with_ai(ai_session, [(p[1], p[5], p[2]) for p in batch])
+                for prepared, ai in zip(batch, replies):
+                    res = self._build_item(prepared, ai)
+                    if res:
+                        self.seen_titles.add(self._normalize_text(res['title_en']))
+                        self.seen_urls.add(_canonical_url(res['url']))
+                        if res['feed_url']: self.seen_urls.add(_canonical_url(res['feed_url']))
+                        self._index_title(res['title_en'])
+                        self.existing_news.append(res)
+                        # Last: only fully recorded items reach Telegram and history
+                        new_items.append(res)
+
+            fetcher = asyncio.ensure_future(fetch_all())
+            ai_tasks = [asyncio.ensure_future(analyze(batch)) async for batch in self._ai_batches(queue)]
+            await fetcher
+            for err in await asyncio.gather(*ai_tasks, return_exceptions=True):
+                if isinstance(err, Exception):
+                    logger.error("AI batch task failed", exc_info=err)
+                    self._failed_items += 1
+        return new_items
+
+    async def send_digest_to_telegram(self, items):
         token = CONFIG['TELEGRAM']['BOT_TOKEN']
         chat_id = CONFIG['TELEGRAM']['CHANNEL_ID']
         if not token or not chat_id: return
 
         try:
-            with open(CONFIG['FILES']['MARKET'], 'r') as f: mkt = json.load(f)
+            with open(CONFIG['FILES']['MARKET'], 'rb') as f: mkt = _json_loads(f.read())
             market_text = f"💵 <b>دلار:</b> {mkt.get('usd')} | 🛢 <b>نفت:</b> {mkt.get('oil')}"
-        except: market_text = ""
+        except (OSError, ValueError, AttributeError): market_text = ""
 
-        proxies = self.fetch_best_proxies()
+        proxies = await self.fetch_best_proxies()
         reply_markup = None
         
         if proxies:
@@ -373,13 +996,15 @@ class IranNewsRadar:
         footer = "\n🆔 @RasadAIOfficial\n📊 <a href='https://itsyebekhe.github.io/rasadai/'>مشاهده داشبورد کامل</a>"
 
         messages_to_send = []
-        current_chunk = header
+        chunk_budget = 3900 - len(footer)
+        current_parts = [header]
+        current_len = len(header)
 
         for item in items:
             title = str(item.get('title_fa', item.get('title_en')))
             source = str(item.get('source', 'Unknown'))
             url = str(item.get('url', ''))
-            impact = str(item.get('impact', ''))
+            impact = item['impact']
             urgency = item.get('urgency', 3)
             img_link = item.get('image', '')
             
@@ -387,91 +1012,128 @@ class IranNewsRadar:
             if urgency >= 8: icon = "🚨"
             elif urgency >= 6: icon = "⚠️"
 
-            is_regime = any(x in source.lower() for x in ['tasnim', 'fars', 'irna', 'press', 'mehr'])
-            safe_source = html.escape(source)
+            is_regime = bool(_REGIME_RE.search(source.lower()))
+            safe_source = source.translate(_HTML_TABLE)
             if is_regime: safe_source += " (State Media 🚫)"
 
-            summary_raw = item.get('summary', [])
-            if isinstance(summary_raw, str): summary_raw = [summary_raw]
-            safe_summary = "\n".join([f"▪️ {html.escape(str(s))}" for s in summary_raw])
+            # _build_item guarantees a list of strings
+            safe_summary = "\n".join([f"▪️ {s.translate(_HTML_TABLE)}" for s in item['summary']])
 
             hidden_image = ""
             if img_link:
                 hidden_image = f"<a href='{img_link}'>&#8205;</a>"
 
-            item_html = (
-                f"{icon} {hidden_image}<b><a href='{url}'>{html.escape(title)}</a></b>\n"
-                f"🗞 <i>منبع: {safe_source}</i>\n\n"
-                f"📝 <b>تحلیل:</b>\n{safe_summary}\n\n"
-                f"🎯 <b>تأثیر:</b> {html.escape(impact)}\n\n"
-                f"#{html.escape(str(item.get('tag', 'General'))).replace(' ', '_')}\n"
-                f"〰️〰️〰️〰️〰️〰️〰️\n\n"
+            item_html = _ITEM_TMPL(
+                icon=icon, hidden_image=hidden_image, url=url,
+                title=title.translate(_HTML_TABLE),
+                source=safe_source,
+                summary=safe_summary,
+                impact=impact.translate(_HTML_TABLE),
+                tag=item['tag'].translate(_HASHTAG_TABLE),
             )
 
-            if len(current_chunk) + len(item_html) + len(footer) > 3900:
-                messages_to_send.append(current_chunk + footer)
-                current_chunk = header + item_html
+            if current_len + len(item_html) > chunk_budget:
+                current_parts.append(footer)
+                messages_to_send.append(''.join(current_parts))
+                current_parts = [header, item_html]
+                current_len = len(header) + len(item_html)
             else:
-                current_chunk += item_html
+                current_parts.append(item_html)
+                current_len += len(item_html)
 
-        if current_chunk != header:
-            messages_to_send.append(current_chunk + footer)
+        if len(current_parts) > 1:
+            current_parts.append(footer)
+            messages_to_send.append(''.join(current_parts))
 
         api_url = f"https://api.telegram.org/bot{token}/sendMessage"
-        for i, msg in enumerate(messages_to_send):
-            payload = {"chat_id": chat_id, "text": msg, "parse_mode": "HTML", "disable_web_page_preview": False}
-            if i == len(messages_to_send) - 1 and reply_markup:
-                payload["reply_markup"] = reply_markup
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            for i, msg in enumerate(messages_to_send):
+                payload = {"chat_id": chat_id, "text": msg, "parse_mode": "HTML", "disable_web_page_preview": False}
+                if i == len(messages_to_send) - 1 and reply_markup:
+                    payload["reply_markup"] = reply_markup
+                # Same chat: keep order and stay near Telegram's ~1 msg/sec limit
+                if i: await asyncio.sleep(1.0)
+                await self._post_telegram(session, api_url, payload)
+
+    async def _post_telegram(self, session, api_url, payload):
+        body = _json_dumps(payload)
+        for _ in range(3):
             try:
-                cloudscraper.create_scraper().post(api_url, json=payload)
-                time.sleep(1.5)
-            except: pass
+                async with session.post(api_url, data=body, headers={"Content-Type": "application/json"}) as resp:
+                    if resp.status != 429: return
+                    reply = _json_loads(await resp.read())
+                    retry_after = reply.get('parameters', {}).get('retry_after', 1)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError): return
+            logger.warning(f"Telegram rate limit hit; retrying in {retry_after}s")
+            await asyncio.sleep(retry_after)
 
     def run(self):
         logger.info(">>> Radar Started...")
-        with open(CONFIG['FILES']['MARKET'], 'w') as f: json.dump(self.fetch_market_rates(), f)
+        _write_atomic(CONFIG['FILES']['MARKET'], _json_dumps(self.fetch_market_rates()))
+
+        feed_validators_before = dict(self.feed_validators)
+        results = asyncio.run(self.get_combined_news())
 
-        results = self.get_combined_news()
-        
         unique_batch_results = []
         seen_batch = set()
+        seen_batch_urls = set()
+        # Token sets + inverted index of titles kept so far, so reprints
+        # within this fetch are caught by the same fuzzy rule
+        batch = ([], {})
         for item in results:
-            t = item.get('title', '').rsplit(' - ', 1)[0]
-            if self._is_duplicate_fuzzy(t, self.existing_news): continue
+            t = item['headline'] = _headline(item.get('title', ''))
             if t in seen_batch: continue
+            # Without a link an item can't be deduped across runs or opened
+            if not item.get('url'): continue
+            # Same link from two sources (or a tracking variant) under another title
+            url_key = _canonical_url(item['url'])
+            if url_key in seen_batch_urls: continue
+            # Feed links stored by earlier runs never need a fetch slot
+            if self._is_seen_url(item['url']): continue
+            if self._is_duplicate_fuzzy(t, batch): continue
             seen_batch.add(t)
+            seen_batch_urls.add(url_key)
+            self._index_title(t, *batch)
             unique_batch_results.append(item)
 
         logger.info(f"Total Fetched: {len(results)} | Unique New: {len(unique_batch_results)}")
 
-        new_items = []
-        with concurrent.futures.ThreadPoolExecutor(max_workers=CONFIG['MAX_WORKERS']) as exc:
-            futures = {exc.submit(self.process_item, i): i for i in unique_batch_results}
-            for fut in concurrent.futures.as_completed(futures):
-                res = fut.result()
-                if res:
-                    new_items.append(res)
-                    self.seen_titles.add(self._normalize_text(res['title_en']))
-                    self.seen_urls.add(res['url'])
-                    self.existing_news.append(res)
+        # Fetch and AI slots are handed out in task order; put likely-urgent items first
+        # Score the headline only: publisher names ("... - War on the Rocks") aren't news
+        unique_batch_results.sort(key=lambda x: len(_URGENT_RE.findall(x['headline'])), reverse=True)
+
+        new_items = asyncio.run(self._process_batch(unique_batch_results))
+        self._save_ai_cache()
 
         if new_items:
             # Sort is now safe because 'urgency' is guaranteed int
             new_items.sort(key=lambda x: x.get('urgency', 0), reverse=True)
-            self.send_digest_to_telegram(new_items)
-            
-            all_news = self._load_existing_news()
-            existing_urls_file = {x.get('url') for x in all_news}
-            for ni in new_items:
-                if ni['url'] not in existing_urls_file:
-                    all_news.append(ni)
+            asyncio.run(self.send_digest_to_telegram(new_items))
             
-            all_news.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
-            with open(CONFIG['FILES']['NEWS'], 'w', encoding='utf-8') as f: 
-                json.dump(all_news[:100], f, indent=4, ensure_ascii=False)
+            # existing_news already holds the accepted items (deduplicated via seen_urls).
+            # Select into a new list: the list order backs the _existing_tokens dedup index.
+            kept = heapq.nlargest(100, self.existing_news, key=lambda x: x.get('timestamp', 0))
+            added_urls = {ni['url'] for ni in new_items}
+            # Items older than the whole retained window leave the file as it is
+            if any(x.get('url') in added_urls for x in kept):
+                _write_atomic(CONFIG['FILES']['NEWS'], _json_dumps(kept, pretty=True))
+            else:
+                logger.info("No new item made the news window; skipping rewrite.")
+            # Mark seen only once published: a failed send or write retries next run
+            self._record_history(new_items)
             logger.info(">>> Done.")
         else:
             logger.info(">>> No unique news.")
 
+        # A 304 means "already handled", so advance the validators only when no
+        # item was dropped by a failure; otherwise next run re-reads the feeds
+        if self.feed_validators != feed_validators_before:
+            if self._failed_items:
+                logger.warning(f"{self._failed_items} item(s) failed; keeping old feed validators for a retry")
+            else:
+                _write_atomic(CONFIG['FILES']['FEEDS'], _json_dumps(self.feed_validators))
+        # Closing the last connection checkpoints the WAL back into history.db
+        self.history.close()
+
 if __name__ == "__main__":
     IranNewsRadar().run()